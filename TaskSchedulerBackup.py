@@ -9,6 +9,9 @@ import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
+import backup_archive
+
+TASK_ARCHIVE_NAME = "TaskScheduler"
 
 def setup_logging(log_file):
     """Setup logging configuration."""
@@ -43,7 +46,17 @@ def send_email(subject, body, email_host, email_port, email_user, email_password
     except Exception as e:
         logging.error(f"Failed to send email notification: {str(e)}")
 
-def backup_task(task_path, task_name, backup_path, aws_access_key, aws_secret_key, aws_region, s3_bucket_name, upload_to_taskscheduler, email_host, email_port, email_user, email_password, email_sender, email_to, log_file, folder_name, s3_backup_folder, schtasks):
+def task_backup_key(filename, upload_to_taskscheduler, s3_backup_folder):
+    """Return the S3 key a backup file is stored under."""
+    if upload_to_taskscheduler.lower() == "yes":
+        return f"{s3_backup_folder}/{filename}"
+    return filename
+
+def task_archive_key(datestamp, upload_to_taskscheduler, s3_backup_folder):
+    """Return the S3 key of the archive holding a day's task backups."""
+    return task_backup_key(f"{TASK_ARCHIVE_NAME}_{datestamp}{backup_archive.ARCHIVE_SUFFIX}", upload_to_taskscheduler, s3_backup_folder)
+
+def backup_task(task_path, task_name, backup_path, aws_access_key, aws_secret_key, aws_region, s3_bucket_name, upload_to_taskscheduler, email_host, email_port, email_user, email_password, email_sender, email_to, log_file, folder_name, s3_backup_folder, schtasks, archive_entries=None):
     # Build the full task path
     full_task_path = os.path.join(task_path, task_name)
 
@@ -58,14 +71,16 @@ def backup_task(task_path, task_name, backup_path, aws_access_key, aws_secret_ke
         logging.error(f"Failed to export task: {error_message}")
         return False
 
+    # In archive mode the export is collected and uploaded with the rest of the run
+    if archive_entries is not None:
+        with open(f'{backup_path}{task_name}.xml', 'rb') as exported:
+            archive_entries.append((f'{task_name}.xml', exported.read()))
+        return True
+
     # Upload the backup file to S3
     datestamp = datetime.now().strftime('%Y%m%d')
     s3_filename = f'{task_name}_{datestamp}.xml'
-
-    if upload_to_taskscheduler.lower() == "yes":
-        s3_key = f"{s3_backup_folder}/{s3_filename}"
-    else:
-        s3_key = s3_filename
+    s3_key = task_backup_key(s3_filename, upload_to_taskscheduler, s3_backup_folder)
 
     s3_client = boto3.client(
         's3',
@@ -97,10 +112,15 @@ def delete_old_files(s3_bucket_name, aws_access_key, aws_secret_key, delete_days
         response = s3_client.list_objects_v2(Bucket=s3_bucket_name)
         for obj in response.get('Contents', []):
             filename = obj['Key']
-            if filename.endswith('.xml'):
+            if filename.endswith(('.xml', backup_archive.ARCHIVE_SUFFIX, backup_archive.INDEX_SUFFIX)):
                 date_str = filename.split('_')[-1].split('.')[0]
                 try:
                     file_date = datetime.strptime(date_str, '%Y%m%d')
+                    # Only this job's own archives; a shared bucket may hold other dated tarballs
+                    if not filename.endswith('.xml'):
+                        archive_key = task_archive_key(date_str, upload_to_taskscheduler, s3_backup_folder)
+                        if filename not in (archive_key, backup_archive.index_key_for(archive_key)):
+                            continue
                     if file_date < cutoff_date:
                         # Check if the file is in the specified backup folder
                         if upload_to_taskscheduler.lower() == "yes" and s3_backup_folder in filename:
@@ -116,7 +136,7 @@ def delete_old_files(s3_bucket_name, aws_access_key, aws_secret_key, delete_days
         logging.error(f"Failed to delete old files from S3: {str(e)}")
 
 
-def log_and_backup_tasks_in_folder(folder_name, backup_path, aws_access_key, aws_secret_key, aws_region, s3_bucket_name, upload_to_taskscheduler, email_host, email_port, email_user, email_password, email_sender, email_to, log_file, schtasks, ignored_job_names, s3_backup_folder):
+def log_and_backup_tasks_in_folder(folder_name, backup_path, aws_access_key, aws_secret_key, aws_region, s3_bucket_name, upload_to_taskscheduler, email_host, email_port, email_user, email_password, email_sender, email_to, log_file, schtasks, ignored_job_names, s3_backup_folder, archive_entries=None):
     """Log and backup all tasks within the specified folder and its subfolders."""
     try:
         result = subprocess.run([schtasks, "/Query", "/FO", "LIST", "/V"], capture_output=True, text=True)
@@ -149,13 +169,33 @@ def log_and_backup_tasks_in_folder(folder_name, backup_path, aws_access_key, aws
                     logging.info(f"Ignoring Task: {task_name}")
                     continue
                 logging.info(f"Task: {task_name}")
-                backup_task(task_path, task_name_only, backup_path, aws_access_key, aws_secret_key, aws_region, s3_bucket_name, upload_to_taskscheduler, email_host, email_port, email_user, email_password, email_sender, email_to, log_file, folder_name, s3_backup_folder, schtasks)
+                backup_task(task_path, task_name_only, backup_path, aws_access_key, aws_secret_key, aws_region, s3_bucket_name, upload_to_taskscheduler, email_host, email_port, email_user, email_password, email_sender, email_to, log_file, folder_name, s3_backup_folder, schtasks, archive_entries)
         
     except Exception as e:
         logging.error(f"An error occurred while logging and backing up tasks: {str(e)}")
         return False
     
-def compare_backups_and_notify(s3_bucket_name, s3_backup_folder, aws_access_key, aws_secret_key, aws_region, email_host, email_port, email_user, email_password, email_sender, email_to, log_file):
+def upload_task_archive(archive_entries, aws_access_key, aws_secret_key, aws_region, s3_bucket_name, upload_to_taskscheduler, s3_backup_folder):
+    """Upload all task exports of this run as a single archive plus index."""
+    datestamp = datetime.now().strftime('%Y%m%d')
+    archive_key = task_archive_key(datestamp, upload_to_taskscheduler, s3_backup_folder)
+
+    s3_client = boto3.client(
+        's3',
+        aws_access_key_id=aws_access_key,
+        aws_secret_access_key=aws_secret_key,
+        region_name=aws_region
+    )
+
+    try:
+        backup_archive.upload_archive(s3_client, s3_bucket_name, archive_key, archive_entries)
+        logging.info(f"Uploaded archive with {len(archive_entries)} tasks to S3: s3://{s3_bucket_name}/{archive_key}")
+        return True
+    except Exception as e:
+        logging.error(f"Failed to upload backup archive to S3: {str(e)}")
+        return False
+
+def compare_backups_and_notify(s3_bucket_name, s3_backup_folder, aws_access_key, aws_secret_key, aws_region, email_host, email_port, email_user, email_password, email_sender, email_to, log_file, upload_to_taskscheduler="yes", archive_mode=False):
     """Compare today's backups with yesterday's backups and send email notifications."""
     s3_client = boto3.client(
         's3',
@@ -169,24 +209,37 @@ def compare_backups_and_notify(s3_bucket_name, s3_backup_folder, aws_access_key,
     yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
 
     try:
-        # List objects in the S3 bucket
-        response = s3_client.list_objects_v2(Bucket=s3_bucket_name, Prefix=s3_backup_folder)
-        if 'Contents' not in response:
-            logging.warning(f"No files found in S3 bucket: {s3_bucket_name}/{s3_backup_folder}")
-            return
-
         files_by_date = {'today': [], 'yesterday': []}
-
-        for obj in response['Contents']:
-            filename = obj['Key']
-            if today in filename:
-                # Extract task name without the date or timestamp, preserving file extension
-                task_name = filename.split(f"_{today}")[0]  # Remove the date suffix
-                files_by_date['today'].append(f"{task_name}{filename.split(f'_{today}')[1]}")  # Add the extension back
-            elif yesterday in filename:
-                # Extract task name without the date or timestamp, preserving file extension
-                task_name = filename.split(f"_{yesterday}")[0]  # Remove the date suffix
-                files_by_date['yesterday'].append(f"{task_name}{filename.split(f'_{yesterday}')[1]}")  # Add the extension back
+        indexed_dates = set()
+
+        # Archived days are read from their index instead of the bucket listing.
+        # Yesterday's run may have used archive mode even when today's did not.
+        archived_dates = (('today', today), ('yesterday', yesterday)) if archive_mode else (('yesterday', yesterday),)
+        for date_label, datestamp in archived_dates:
+            index = backup_archive.load_index(s3_client, s3_bucket_name, task_archive_key(datestamp, upload_to_taskscheduler, s3_backup_folder))
+            if index is not None:
+                files_by_date[date_label] = [task_backup_key(name, upload_to_taskscheduler, s3_backup_folder) for name in index['entries']]
+                indexed_dates.add(date_label)
+
+        if len(indexed_dates) < 2:
+            # List objects in the S3 bucket
+            response = s3_client.list_objects_v2(Bucket=s3_bucket_name, Prefix=s3_backup_folder)
+            if 'Contents' not in response and not indexed_dates:
+                logging.warning(f"No files found in S3 bucket: {s3_bucket_name}/{s3_backup_folder}")
+                return
+
+            for obj in response.get('Contents', []):
+                filename = obj['Key']
+                if filename.endswith((backup_archive.ARCHIVE_SUFFIX, backup_archive.INDEX_SUFFIX)):
+                    continue
+                if today in filename and 'today' not in indexed_dates:
+                    # Extract task name without the date or timestamp, preserving file extension
+                    task_name = filename.split(f"_{today}")[0]  # Remove the date suffix
+                    files_by_date['today'].append(f"{task_name}{filename.split(f'_{today}')[1]}")  # Add the extension back
+                elif yesterday in filename and 'yesterday' not in indexed_dates:
+                    # Extract task name without the date or timestamp, preserving file extension
+                    task_name = filename.split(f"_{yesterday}")[0]  # Remove the date suffix
+                    files_by_date['yesterday'].append(f"{task_name}{filename.split(f'_{yesterday}')[1]}")  # Add the extension back
 
         # Determine new files and deleted files based on task name
         today_files = set(files_by_date['today'])
@@ -239,6 +292,7 @@ def main(env_file_path):
     s3_backup_folder = os.getenv("S3_BACKUP_FOLDER")
     schtasks = os.getenv("PATH_OF_SCHTASKS")
     upload_to_taskscheduler = os.getenv("UPLOAD_TO_TASKSCHEDULER", "yes")
+    archive_mode = os.getenv("ARCHIVE_MODE", "no").strip().lower() == "yes"
 
     # Email configuration
     email_host = os.getenv("EMAIL_HOST")
@@ -252,9 +306,15 @@ def main(env_file_path):
     log_file = os.path.join(backup_path, "taskchedulerscript.log")
     setup_logging(log_file)
 
+    # In archive mode exports are collected here and uploaded once after all folders
+    archive_entries = [] if archive_mode else None
+
     # Log and backup tasks in each specified folder
     for folder_name in folder_names:
-        log_and_backup_tasks_in_folder(folder_name.strip(), backup_path, aws_access_key, aws_secret_key, aws_region, s3_bucket_name, upload_to_taskscheduler, email_host, email_port, email_user, email_password, email_sender, email_to, log_file, schtasks, ignored_job_names, s3_backup_folder)
+        log_and_backup_tasks_in_folder(folder_name.strip(), backup_path, aws_access_key, aws_secret_key, aws_region, s3_bucket_name, upload_to_taskscheduler, email_host, email_port, email_user, email_password, email_sender, email_to, log_file, schtasks, ignored_job_names, s3_backup_folder, archive_entries)
+
+    if archive_entries:
+        upload_task_archive(archive_entries, aws_access_key, aws_secret_key, aws_region, s3_bucket_name, upload_to_taskscheduler, s3_backup_folder)
 
     # Delete old files from the S3 bucket
     delete_old_files(s3_bucket_name, aws_access_key, aws_secret_key, delete_days, upload_to_taskscheduler, folder_names, s3_backup_folder)
@@ -272,7 +332,9 @@ def main(env_file_path):
         email_password=email_password,
         email_sender=email_sender,
         email_to=email_to,
-        log_file=log_file
+        log_file=log_file,
+        upload_to_taskscheduler=upload_to_taskscheduler,
+        archive_mode=archive_mode
     )
 
 
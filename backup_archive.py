@@ -0,0 +1,81 @@
+import io
+import gzip
+import json
+import tarfile
+import time
+
+# Archive layout shared by crontab_backup.py and TaskSchedulerBackup.py.
+#
+# A run's artifacts are packed into a single uncompressed tar whose members are
+# individually gzip-compressed ("<name>.gz"). The tar can still be unpacked with
+# standard tools, and because every member is stored contiguously, a JSON index
+# uploaded next to the archive records the byte offset and length of each member
+# so one entry can be fetched with a ranged GET instead of downloading the whole
+# archive.
+
+ARCHIVE_SUFFIX = '.tar'
+INDEX_SUFFIX = '.index.json'
+
+
+def index_key_for(archive_key):
+    """Return the S3 key of the index that belongs to an archive key."""
+    if archive_key.endswith(ARCHIVE_SUFFIX):
+        archive_key = archive_key[:-len(ARCHIVE_SUFFIX)]
+    return archive_key + INDEX_SUFFIX
+
+
+def build_archive(entries):
+    """Pack (name, bytes) pairs into a tar archive and return (archive_bytes, index)."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w', format=tarfile.PAX_FORMAT) as tar:
+        for name, content in entries:
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+            compressed = gzip.compress(content, mtime=0)
+            info = tarfile.TarInfo(name=f"{name}.gz")
+            info.size = len(compressed)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(compressed))
+
+    # Member data offsets are only known once the headers are written, so read them back
+    buffer.seek(0)
+    with tarfile.open(fileobj=buffer, mode='r') as tar:
+        index = {
+            'version': 1,
+            'compression': 'gzip',
+            'entries': {
+                info.name[:-len('.gz')]: {'offset': info.offset_data, 'length': info.size}
+                for info in tar.getmembers()
+            }
+        }
+    return buffer.getvalue(), index
+
+
+def upload_archive(s3_client, s3_bucket_name, archive_key, entries):
+    """Upload an archive and its index, returning the index."""
+    archive_bytes, index = build_archive(entries)
+    index['archive'] = archive_key
+    s3_client.put_object(Bucket=s3_bucket_name, Key=archive_key, Body=archive_bytes)
+    s3_client.put_object(Bucket=s3_bucket_name, Key=index_key_for(archive_key), Body=json.dumps(index).encode('utf-8'))
+    return index
+
+
+def load_index(s3_client, s3_bucket_name, archive_key):
+    """Fetch the index for an archive, or None if the archive does not exist."""
+    try:
+        body = s3_client.get_object(Bucket=s3_bucket_name, Key=index_key_for(archive_key))['Body'].read()
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    index = json.loads(body.decode('utf-8'))
+    index.setdefault('archive', archive_key)
+    return index
+
+
+def read_entry(s3_client, s3_bucket_name, index, name):
+    """Fetch a single entry from an archive with a ranged GET, or None if absent."""
+    entry = index['entries'].get(name)
+    if entry is None:
+        return None
+    byte_range = f"bytes={entry['offset']}-{entry['offset'] + entry['length'] - 1}"
+    body = s3_client.get_object(Bucket=s3_bucket_name, Key=index['archive'], Range=byte_range)['Body'].read()
+    return gzip.decompress(body)
@@ -0,0 +1,393 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import importlib
+import threading
+import json
+import logging
+import subprocess
+import socketserver
+import tracemalloc
+import resource
+import smtplib
+from collections import Counter
+from datetime import datetime, timedelta
+import boto3
+import backup_archive
+from TaskSchedulerBackup import task_archive_key, task_backup_key
+
+# End-to-end benchmark for crontab_backup.py and TaskSchedulerBackup.py.
+#
+# Each pipeline's main() runs unchanged, in its own child process so its
+# memory figures are its own, against:
+#   - a moto S3 server running in this process (pip install "moto[server]"),
+#     reached through AWS_ENDPOINT_URL (botocore >= 1.31)
+#   - an in-process SMTP sink that accepts any login
+#   - fake sudo/crontab/schtasks executables put first on PATH
+# The bucket is seeded straight into moto's backend with dated backup keys,
+# so listing, diff and retention costs can be measured at up to millions of
+# keys (moto keeps roughly 4 KiB per key in this process). Yesterday's backups
+# of the benchmarked users and tasks are seeded too (per-object or archive,
+# following --archive-mode) so the diff against yesterday runs.
+#
+#   python benchmark_backups.py --bucket-keys 100000 --users 50 --tasks 500
+#   python benchmark_backups.py --pipeline tasks --archive-mode
+
+BUCKET_NAME = 'backup-benchmark'
+CRONTAB_S3_PATH = 'Crontab_backup/benchmark'
+CRONTAB_BACKUP_FILENAME = 'benchmark'
+TASK_S3_FOLDER = 'TaskScheduler'
+TASK_FOLDER = 'BenchFolder'
+UPLOAD_TO_TASKSCHEDULER = 'yes'
+FILLER_CONTENT = b'0 * * * * /bin/true\n'
+CRONTAB_LINE = "{minute} * * * * /opt/jobs/{user}/job_{i}.sh >> /var/log/{user}_{i}.log 2>&1"
+
+FAKE_SUDO = '''#!{python}
+import os, sys
+# sudo -u <user> <command...>
+os.environ['BENCH_USER'] = sys.argv[2]
+os.execvp(sys.argv[3], sys.argv[3:])
+'''
+
+FAKE_CRONTAB = '''#!{python}
+import os, sys
+user = os.environ.get('BENCH_USER', 'root')
+if sys.argv[1:] == ['-l']:
+    for i in range(int(os.environ['BENCH_CRONTAB_LINES'])):
+        print({line!r}.format(minute=i % 60, user=user, i=i))
+else:
+    sys.stdin.read()
+'''
+
+FAKE_SCHTASKS = '''#!{python}
+import os, sys
+args = sys.argv[1:]
+folder = os.environ['BENCH_TASK_FOLDER']
+task_count = int(os.environ['BENCH_TASK_COUNT'])
+if '/FO' in args:
+    for i in range(task_count):
+        print("HostName: BENCH")
+        print(f"TaskName: \\\\{{folder}}\\\\Task{{i:06d}}")
+        print("Status: Ready")
+        print("")
+elif '/TN' in args:
+    task_path = args[args.index('/TN') + 1].replace('/', '\\\\')
+    print('<?xml version="1.0" encoding="UTF-8"?>')
+    print('<Task version="1.2" xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task">')
+    print(f'  <RegistrationInfo><URI>\\\\{{task_path}}</URI></RegistrationInfo>')
+    print('  <Actions Context="Author"><Exec><Command>C:\\\\jobs\\\\run.bat</Command></Exec></Actions>')
+    print('</Task>')
+'''
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP dialogue: accepts any login and counts delivered messages."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+    def handle(self):
+        self.reply("220 benchmark SMTP sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply("250-benchmark")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif command.startswith('AUTH'):
+                self.reply("235 Authentication successful")
+            elif command == 'DATA':
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                self.server.message_count += 1
+                self.reply("250 OK")
+            elif command == 'QUIT':
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, SMTPSinkHandler)
+        self.message_count = 0
+
+class S3RequestCounter:
+    """Counts S3 API calls made by every boto3 client created from the default session."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        boto3.setup_default_session()
+        boto3.DEFAULT_SESSION.events.register('before-call.s3', self.count)
+
+    def count(self, model, **kwargs):
+        with self.lock:
+            self.counts[model.name] += 1
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start within {timeout}s")
+
+def start_moto_server(port):
+    """Start moto's S3 server in this process and return it with its S3 backend."""
+    from moto.server import ThreadedMotoServer
+    from moto.s3.models import s3_backends
+    from moto.core import DEFAULT_ACCOUNT_ID
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=port, verbose=False)
+    server.start()
+    wait_for_port(port)
+    return server, s3_backends[DEFAULT_ACCOUNT_ID]['global']
+
+def write_fake_executables(bin_dir):
+    for name, template in (('sudo', FAKE_SUDO), ('crontab', FAKE_CRONTAB), ('schtasks', FAKE_SCHTASKS)):
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as script:
+            script.write(template.format(python=sys.executable, line=CRONTAB_LINE))
+        os.chmod(path, 0o755)
+
+def write_env_file(path, values):
+    with open(path, 'w') as env_file:
+        for key, value in values.items():
+            env_file.write(f"{key}={value}\n")
+
+def seed_bucket(s3_backend, items):
+    """Store (key, content) pairs directly in moto's backend, without a request per key."""
+    for key, content in items:
+        s3_backend.put_object(BUCKET_NAME, key, content)
+
+def filler_keys(pipeline, count, history_days):
+    """Yield (key, content) shaped like earlier backups, spread over history_days days before yesterday.
+
+    Yesterday is left to prefill_yesterday so the diff sees the same previous
+    run in both layouts.
+    """
+    dates = [(datetime.now() - timedelta(days=day)).strftime('%Y%m%d') for day in range(2, history_days + 2)]
+    for i in range(count):
+        datestamp = dates[i % len(dates)]
+        if pipeline == 'crontab':
+            yield f"{CRONTAB_S3_PATH}/filler{i // len(dates):07d}_{CRONTAB_BACKUP_FILENAME}_{datestamp}.txt", FILLER_CONTENT
+        else:
+            yield task_backup_key(f"FillerTask{i // len(dates):07d}_{datestamp}.xml", UPLOAD_TO_TASKSCHEDULER, TASK_S3_FOLDER), FILLER_CONTENT
+
+def crontab_content(user, lines):
+    """Return the crontab the fake crontab prints for a user."""
+    return ''.join(CRONTAB_LINE.format(minute=i % 60, user=user, i=i) + '\n' for i in range(lines))
+
+def yesterday_entries(pipeline, args):
+    """Yield (name, content) for yesterday's backups of the users or tasks being benchmarked.
+
+    Crontabs differ from today's in their first and last line, so the line
+    diff and its change email are exercised on every run.
+    """
+    if pipeline == 'crontab':
+        for i in range(args.users):
+            user = f'user{i:04d}'
+            lines = crontab_content(user, args.crontab_lines).splitlines(keepends=True)
+            if lines:
+                lines[0] = lines[0].replace('* * * *', '*/5 * * *', 1)
+            yield f'{user}.txt', ''.join(lines[:-1]).encode('utf-8')
+    else:
+        for i in range(args.tasks):
+            task_name = f'Task{i:06d}'
+            yield f'{task_name}.xml', f'<Task><RegistrationInfo><URI>\\{TASK_FOLDER}\\{task_name}</URI></RegistrationInfo></Task>'.encode('utf-8')
+
+def prefill_yesterday(s3_client, s3_backend, pipeline, args):
+    """Store yesterday's backups in the layout selected by --archive-mode."""
+    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
+    entries = list(yesterday_entries(pipeline, args))
+    if args.archive_mode:
+        if pipeline == 'crontab':
+            archive_key = f"{CRONTAB_S3_PATH}/{CRONTAB_BACKUP_FILENAME}_{yesterday}{backup_archive.ARCHIVE_SUFFIX}"
+        else:
+            archive_key = task_archive_key(yesterday, UPLOAD_TO_TASKSCHEDULER, TASK_S3_FOLDER)
+        backup_archive.upload_archive(s3_client, BUCKET_NAME, archive_key, entries)
+        return
+
+    def object_key(name):
+        stem = name.rsplit('.', 1)[0]
+        if pipeline == 'crontab':
+            return f"{CRONTAB_S3_PATH}/{stem}_{CRONTAB_BACKUP_FILENAME}_{yesterday}.txt"
+        return task_backup_key(f"{stem}_{yesterday}.xml", UPLOAD_TO_TASKSCHEDULER, TASK_S3_FOLDER)
+
+    seed_bucket(s3_backend, ((object_key(name), content) for name, content in entries))
+
+def peak_rss_kb():
+    """Peak resident memory of this process in KiB.
+
+    On Linux ru_maxrss carries the parent's peak over fork/exec, so the
+    high-water mark of this process's own address space is read instead.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_pipeline(module_name, env_file_path):
+    """Run a backup script's main() in this (child) process and collect wall time, S3 calls and memory."""
+    # The sink has no TLS; both scripts call starttls() before logging in
+    smtplib.SMTP.starttls = lambda self, *a, **kw: (220, b'Ready')
+    counter = S3RequestCounter()
+    module = importlib.import_module(module_name)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    module.main(env_file_path)
+    wall_time = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'wall_time': wall_time,
+        's3_requests': dict(counter.counts),
+        'peak_python_memory': peak_memory,
+        'max_rss_kb': peak_rss_kb(),
+        'errors': list(getattr(module, 'error_messages', [])),
+    }
+
+def run_pipeline_process(module_name, env_file_path, result_path, smtp_sink):
+    """Run a pipeline in a fresh child process so its memory is not mixed with seeding or other pipelines."""
+    messages_before = smtp_sink.message_count
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--run-pipeline', module_name, '--env-file', env_file_path, '--result-file', result_path], check=True)
+    with open(result_path) as result_file:
+        result = json.load(result_file)
+    result['emails'] = smtp_sink.message_count - messages_before
+    return result
+
+def print_report(name, result):
+    print(f"\n== {name} ==")
+    print(f"wall time:          {result['wall_time']:.3f}s")
+    print(f"peak python memory: {result['peak_python_memory'] / 1024 / 1024:.1f} MiB")
+    print(f"max RSS (pipeline): {result['max_rss_kb'] / 1024:.1f} MiB (child process, interpreter and imports included)")
+    print(f"emails sent:        {result['emails']}")
+    print(f"S3 requests:        {sum(result['s3_requests'].values())}")
+    for operation, count in sorted(result['s3_requests'].items()):
+        print(f"  {operation:<20}{count}")
+    for error in result['errors']:
+        print(f"error: {error}")
+
+def main(args):
+    work_dir = tempfile.mkdtemp(prefix='backup-benchmark-')
+    bin_dir = os.path.join(work_dir, 'bin')
+    backup_path = os.path.join(work_dir, 'tasks') + os.sep
+    os.makedirs(bin_dir)
+    os.makedirs(backup_path)
+    write_fake_executables(bin_dir)
+
+    s3_port = args.port or free_port()
+    moto_server, s3_backend = start_moto_server(s3_port)
+    smtp_sink = SMTPSink(('127.0.0.1', 0))
+    threading.Thread(target=smtp_sink.serve_forever, daemon=True).start()
+
+    # Inherited by the pipeline child processes
+    os.environ.update({
+        'PATH': bin_dir + os.pathsep + os.environ.get('PATH', ''),
+        'AWS_ENDPOINT_URL': f'http://127.0.0.1:{s3_port}',
+        'BENCH_CRONTAB_LINES': str(args.crontab_lines),
+        'BENCH_TASK_FOLDER': TASK_FOLDER,
+        'BENCH_TASK_COUNT': str(args.tasks),
+    })
+    common_env = {
+        'AWS_ACCESS_KEY': 'benchmark',
+        'AWS_SECRET_KEY': 'benchmark',
+        'AWS_REGION': 'us-east-1',
+        'S3_BUCKET_NAME': BUCKET_NAME,
+        'EMAIL_HOST': '127.0.0.1',
+        'EMAIL_PORT': smtp_sink.server_address[1],
+        'EMAIL_USER': 'benchmark',
+        'EMAIL_PASSWORD': 'benchmark',
+        'EMAIL_SENDER': 'benchmark@example.com',
+        'EMAIL_TO': 'ops@example.com',
+        'ARCHIVE_MODE': 'yes' if args.archive_mode else 'no',
+    }
+    crontab_env = os.path.join(work_dir, '.env.crontab_backup')
+    write_env_file(crontab_env, dict(common_env, **{
+        'CRONTAB_BACKUP_FILENAME': CRONTAB_BACKUP_FILENAME,
+        'DELETE_BACKUP_DAYS': args.retention_days,
+        'USERS': ','.join(f'user{i:04d}' for i in range(args.users)),
+        'S3_PATH': CRONTAB_S3_PATH,
+    }))
+    tasks_env = os.path.join(work_dir, '.env.TaskSchedulerBackup')
+    write_env_file(tasks_env, dict(common_env, **{
+        'TASK_SCHEDULER_FOLDERS': TASK_FOLDER,
+        'IGNORED_JOB_NAMES': '',
+        'BACKUP_PATH': backup_path,
+        'DELETE_DAYS': args.retention_days,
+        'S3_BACKUP_FOLDER': TASK_S3_FOLDER,
+        'PATH_OF_SCHTASKS': os.path.join(bin_dir, 'schtasks'),
+        'UPLOAD_TO_TASKSCHEDULER': UPLOAD_TO_TASKSCHEDULER,
+    }))
+
+    pipelines = {'crontab': ('crontab_backup', crontab_env), 'tasks': ('TaskSchedulerBackup', tasks_env)}
+    selected = list(pipelines) if args.pipeline == 'all' else [args.pipeline]
+
+    try:
+        s3_client = boto3.client('s3', region_name='us-east-1', aws_access_key_id='benchmark', aws_secret_access_key='benchmark')
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+
+        for pipeline in selected:
+            print(f"Pre-filling bucket with {args.bucket_keys} {pipeline} keys plus yesterday's backups...")
+            start = time.perf_counter()
+            seed_bucket(s3_backend, filler_keys(pipeline, args.bucket_keys, args.history_days))
+            prefill_yesterday(s3_client, s3_backend, pipeline, args)
+            print(f"Pre-filled in {time.perf_counter() - start:.1f}s")
+
+            module_name, env_file_path = pipelines[pipeline]
+            result_path = os.path.join(work_dir, f'{pipeline}.json')
+            print_report(pipeline, run_pipeline_process(module_name, env_file_path, result_path, smtp_sink))
+    finally:
+        smtp_sink.shutdown()
+        moto_server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the crontab and Task Scheduler backup pipelines against local stand-ins.")
+    parser.add_argument("--pipeline", choices=['crontab', 'tasks', 'all'], default='all')
+    parser.add_argument("--bucket-keys", type=int, default=1000, help="Existing backup keys to pre-fill per pipeline")
+    parser.add_argument("--history-days", type=int, default=7, help="Number of days before yesterday the pre-filled keys are spread over")
+    parser.add_argument("--retention-days", type=int, default=30, help="DELETE_BACKUP_DAYS / DELETE_DAYS for the run")
+    parser.add_argument("--users", type=int, default=10, help="Crontab users to back up")
+    parser.add_argument("--crontab-lines", type=int, default=20, help="Lines in each fake crontab")
+    parser.add_argument("--tasks", type=int, default=50, help="Scheduled tasks reported by the fake schtasks")
+    parser.add_argument("--archive-mode", action='store_true', help="Run with ARCHIVE_MODE=yes")
+    parser.add_argument("--port", type=int, help="Port for the moto server (default: a free port)")
+    # Internal: run one pipeline in a child process and write its metrics as JSON
+    parser.add_argument("--run-pipeline", help=argparse.SUPPRESS)
+    parser.add_argument("--env-file", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_pipeline:
+        result = run_pipeline(args.run_pipeline, args.env_file)
+        with open(args.result_file, 'w') as result_file:
+            json.dump(result, result_file)
+    else:
+        main(args)
@@ -9,6 +9,7 @@ from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
 import argparse
 import difflib
+import backup_archive
 
 # Generate timestamp
 timestamp = datetime.now().strftime('%Y%m%d')
@@ -48,8 +49,58 @@ def upload_to_s3(content, s3_bucket_name, s3_key):
         print(error_message)
         error_messages.append(error_message)
 
-# Compare backups and send a report
-def compare_backups(s3_bucket_name, user, s3_key_today):
+# Diff two crontab snapshots and email the changes
+def report_crontab_changes(user, today_content, yesterday_content):
+    crontab_backup_filename = os.getenv('CRONTAB_BACKUP_FILENAME')
+    if yesterday_content is None:
+        send_email(f"New crontab backup created for user {user} on {crontab_backup_filename}", f"Today's crontab backup for user {user} is new and no prior backup exists.")
+        return
+
+    added_lines = []
+    removed_lines = []
+    modified_lines = []
+
+    old_lines = yesterday_content.splitlines()
+    new_lines = today_content.splitlines()
+
+    max_lines = max(len(old_lines), len(new_lines))
+    
+
+    for line_no in range(max_lines):
+        old_line = old_lines[line_no].strip() if line_no < len(old_lines) else None
+        new_line = new_lines[line_no].strip() if line_no < len(new_lines) else None
+
+        # Skip blank lines
+        if not old_line and not new_line:
+            continue
+
+        if old_line is None and new_line:
+            added_lines.append(f"Line {line_no + 1}: {new_line}")
+        elif old_line and new_line is None:
+            removed_lines.append(f"Line {line_no + 1}: {old_line}")
+        elif old_line != new_line:
+            modified_lines.append(f"Line {line_no + 1}:\n  Old: {old_line}\n  New: {new_line}")
+
+
+    changes_summary = []
+    if added_lines:
+        changes_summary.append("*Added Lines:*\n\n" + "\n".join(added_lines) + "\n")
+    if removed_lines:
+        changes_summary.append("*Removed Lines:*\n\n" + "\n".join(removed_lines) + "\n")
+    if modified_lines:
+        changes_summary.append("*Modified Lines:*\n\n" + "\n".join(modified_lines) + "\n")
+
+    if changes_summary:
+        email_body = "\n\n".join(changes_summary)
+        send_email(
+            f"Crontab changes detected for user {user} on {crontab_backup_filename}",
+            f"Changes found in the crontab for user {user}:\n\n{email_body}"
+        )
+    else:
+        print(f"No changes detected in the crontab for user {user} on {crontab_backup_filename}")
+
+# Load the index of yesterday's archive, if yesterday's run used archive mode
+def load_yesterday_index(s3_bucket_name):
     try:
         s3_client = boto3.client(
             's3',
@@ -59,65 +110,97 @@ def compare_backups(s3_bucket_name, user, s3_key_today):
         )
         s3_path = os.getenv('S3_PATH', '').strip()
         crontab_backup_filename = os.getenv('CRONTAB_BACKUP_FILENAME')
+        yesterday_date = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
+        archive_key_yesterday = f"{crontab_backup_filename}_{yesterday_date}{backup_archive.ARCHIVE_SUFFIX}"
+        if s3_path:
+            archive_key_yesterday = os.path.join(s3_path, archive_key_yesterday)
+        return backup_archive.load_index(s3_client, s3_bucket_name, archive_key_yesterday)
+    except Exception as e:
+        error_message = f"Error loading yesterday's archive index: {e}"
+        print(error_message)
+        error_messages.append(error_message)
+        return None
+
+# Fetch yesterday's crontab for a user from yesterday's archive or per-user object
+def get_yesterday_crontab(s3_client, s3_bucket_name, user, index_yesterday):
+    if index_yesterday is not None:
+        yesterday_content = backup_archive.read_entry(s3_client, s3_bucket_name, index_yesterday, f"{user}.txt")
+        if yesterday_content is not None:
+            return yesterday_content.decode('utf-8')
+
+    s3_path = os.getenv('S3_PATH', '').strip()
+    crontab_backup_filename = os.getenv('CRONTAB_BACKUP_FILENAME')
+    yesterday_date = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
+    s3_key_yesterday = f"{user}_{crontab_backup_filename}_{yesterday_date}.txt"
+    if s3_path:
+        s3_key_yesterday = os.path.join(s3_path, s3_key_yesterday)
+    try:
+        return s3_client.get_object(Bucket=s3_bucket_name, Key=s3_key_yesterday)['Body'].read().decode('utf-8')
+    except s3_client.exceptions.NoSuchKey:
+        return None
+
+# Compare backups and send a report
+def compare_backups(s3_bucket_name, user, s3_key_today, index_yesterday=None):
+    try:
+        s3_client = boto3.client(
+            's3',
+            aws_access_key_id=os.getenv('AWS_ACCESS_KEY'),
+            aws_secret_access_key=os.getenv('AWS_SECRET_KEY'),
+            region_name=os.getenv('AWS_REGION')
+        )
+        s3_path = os.getenv('S3_PATH', '').strip()
         if s3_path:
             s3_key_today = os.path.join(s3_path, s3_key_today)
-        yesterday_date = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
-        s3_key_yesterday = s3_key_today.replace(timestamp, yesterday_date)
 
         today_content = s3_client.get_object(Bucket=s3_bucket_name, Key=s3_key_today)['Body'].read().decode('utf-8')
-        try:
-            yesterday_content = s3_client.get_object(Bucket=s3_bucket_name, Key=s3_key_yesterday)['Body'].read().decode('utf-8')
-        except s3_client.exceptions.NoSuchKey:
-            send_email(f"New crontab backup created for user {user} on {crontab_backup_filename}", f"Today's crontab backup for user {user} is new and no prior backup exists.")
-            return
-
-        added_lines = []
-        removed_lines = []
-        modified_lines = []
-
-        old_lines = yesterday_content.splitlines()
-        new_lines = today_content.splitlines()
-
-        max_lines = max(len(old_lines), len(new_lines))
-        
-
-        for line_no in range(max_lines):
-            old_line = old_lines[line_no].strip() if line_no < len(old_lines) else None
-            new_line = new_lines[line_no].strip() if line_no < len(new_lines) else None
-
-            # Skip blank lines
-            if not old_line and not new_line:
-                continue
-
-            if old_line is None and new_line:
-                added_lines.append(f"Line {line_no + 1}: {new_line}")
-            elif old_line and new_line is None:
-                removed_lines.append(f"Line {line_no + 1}: {old_line}")
-            elif old_line != new_line:
-                modified_lines.append(f"Line {line_no + 1}:\n  Old: {old_line}\n  New: {new_line}")
-
-
-        changes_summary = []
-        if added_lines:
-            changes_summary.append("*Added Lines:*\n\n" + "\n".join(added_lines) + "\n")
-        if removed_lines:
-            changes_summary.append("*Removed Lines:*\n\n" + "\n".join(removed_lines) + "\n")
-        if modified_lines:
-            changes_summary.append("*Modified Lines:*\n\n" + "\n".join(modified_lines) + "\n")
-
-        if changes_summary:
-            email_body = "\n\n".join(changes_summary)
-            send_email(
-                f"Crontab changes detected for user {user} on {crontab_backup_filename}",
-                f"Changes found in the crontab for user {user}:\n\n{email_body}"
-            )
-        else:
-            print(f"No changes detected in the crontab for user {user} on {crontab_backup_filename}")
+        yesterday_content = get_yesterday_crontab(s3_client, s3_bucket_name, user, index_yesterday)
+
+        report_crontab_changes(user, today_content, yesterday_content)
     except Exception as e:
         error_message = f"Error comparing backups: {e}"
         print(error_message)
         error_messages.append(error_message)
 
+# Upload all of today's crontabs as a single archive plus index
+def upload_archive_to_s3(crontab_contents, s3_bucket_name, archive_key):
+    try:
+        s3_client = boto3.client(
+            's3',
+            aws_access_key_id=os.getenv('AWS_ACCESS_KEY'),
+            aws_secret_access_key=os.getenv('AWS_SECRET_KEY'),
+            region_name=os.getenv('AWS_REGION')
+        )
+        s3_path = os.getenv('S3_PATH', '').strip()
+        if s3_path:
+            archive_key = os.path.join(s3_path, archive_key)
+        entries = [(f"{user}.txt", content) for user, content in crontab_contents.items()]
+        backup_archive.upload_archive(s3_client, s3_bucket_name, archive_key, entries)
+        print(f"Crontab archive with {len(entries)} entries uploaded to S3 bucket {s3_bucket_name} with key {archive_key}")
+        return True
+    except (NoCredentialsError, ClientError) as e:
+        error_message = f"Error uploading archive to S3: {e}"
+        print(error_message)
+        error_messages.append(error_message)
+        return False
+
+# Compare today's archived crontabs against yesterday's backups and send reports
+def compare_archived_backups(s3_bucket_name, crontab_contents, index_yesterday=None):
+    s3_client = boto3.client(
+        's3',
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_KEY'),
+        region_name=os.getenv('AWS_REGION')
+    )
+
+    for user, today_content in crontab_contents.items():
+        try:
+            yesterday_content = get_yesterday_crontab(s3_client, s3_bucket_name, user, index_yesterday)
+            report_crontab_changes(user, today_content, yesterday_content)
+        except Exception as e:
+            error_message = f"Error comparing backups for user {user}: {e}"
+            print(error_message)
+            error_messages.append(error_message)
+
 # Delete old backups from S3 
 def delete_old_backups(s3_bucket_name, delete_backup_days):
     deleted_backups = []
@@ -134,7 +217,7 @@ def delete_old_backups(s3_bucket_name, delete_backup_days):
         response = s3_client.list_objects_v2(Bucket=s3_bucket_name, Prefix=s3_path + '/')
         for obj in response.get('Contents', []):
             key = obj['Key']
-            if key.endswith('.txt'):
+            if key.endswith(('.txt', backup_archive.ARCHIVE_SUFFIX, backup_archive.INDEX_SUFFIX)):
                 date_str = key.split('_')[-1].split('.')[0]
                 try:
                     backup_date = datetime.strptime(date_str, '%Y%m%d')
@@ -177,15 +260,27 @@ def main(env_file_path):
     s3_bucket_name = os.getenv('S3_BUCKET_NAME')
     delete_backup_days = os.getenv('DELETE_BACKUP_DAYS', '1')
     users = os.getenv('USERS')
+    archive_mode = os.getenv('ARCHIVE_MODE', 'no').strip().lower() == 'yes'
 
     if users:
+        # Yesterday's run may have used either layout, whatever today's mode is
+        index_yesterday = load_yesterday_index(s3_bucket_name)
+        crontab_contents = {}
         for user in users.split(','):
             user = user.strip()
             user_crontab_content = capture_crontab(user)
             if user_crontab_content:
+                if archive_mode:
+                    crontab_contents[user] = user_crontab_content
+                    continue
                 user_s3_key = f"{user}_{crontab_backup_filename}_{timestamp}.txt"
                 upload_to_s3(user_crontab_content, s3_bucket_name, user_s3_key)
-                compare_backups(s3_bucket_name, user, user_s3_key)
+                compare_backups(s3_bucket_name, user, user_s3_key, index_yesterday)
+
+        if crontab_contents:
+            archive_key = f"{crontab_backup_filename}_{timestamp}{backup_archive.ARCHIVE_SUFFIX}"
+            if upload_archive_to_s3(crontab_contents, s3_bucket_name, archive_key):
+                compare_archived_backups(s3_bucket_name, crontab_contents, index_yesterday)
 
     delete_old_backups(s3_bucket_name, delete_backup_days)
 
@@ -0,0 +1,172 @@
+from sqlalchemy import create_engine, Table, MetaData, or_, bindparam, text
+from sqlalchemy.orm import sessionmaker
+import base64
+import hashlib
+import os
+import re
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Get the current and new encryption keys and database credentials from the .env file
+encryption_key = os.getenv('ENCRYPTION_KEY')
+new_encryption_key = os.getenv('NEW_ENCRYPTION_KEY')
+key_version_column = os.getenv('KEY_VERSION_COLUMN', 'key_version')
+chunk_size = int(os.getenv('ROTATION_CHUNK_SIZE', 1000))
+db_name = os.getenv('DB_NAME')
+db_host = os.getenv('DB_HOST')
+db_port = os.getenv('DB_PORT')
+db_user = os.getenv('DB_USER')
+db_password = os.getenv('DB_PASSWORD')
+
+# Decode the base64-encoded encryption keys (removing 'base64:' prefix)
+old_key = base64.b64decode(encryption_key.replace('base64:', ''))
+new_key = base64.b64decode(new_encryption_key.replace('base64:', ''))
+
+# Rows already re-encrypted carry this marker, so an interrupted rotation can be resumed.
+# Defaults to a fingerprint of the new key so the key itself is never stored.
+key_version = os.getenv('KEY_VERSION') or hashlib.sha256(new_key).hexdigest()[:16]
+
+# Decryption function using AES
+def decrypt_data(encrypted_data, key):
+    backend = default_backend()
+    cipher = Cipher(algorithms.AES(key), modes.ECB(), backend=backend)
+    decryptor = cipher.decryptor()
+
+    # Decode the base64-encoded encrypted data
+    encrypted_data_bytes = base64.b64decode(encrypted_data)
+
+    decrypted_padded_data = decryptor.update(encrypted_data_bytes) + decryptor.finalize()
+
+    # Unpad the decrypted data
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    decrypted_data = unpadder.update(decrypted_padded_data) + unpadder.finalize()
+
+    return decrypted_data.decode('utf-8')
+
+# Encryption function using AES
+def encrypt_data(data, key):
+    backend = default_backend()
+    cipher = Cipher(algorithms.AES(key), modes.ECB(), backend=backend)
+    encryptor = cipher.encryptor()
+
+    padder = padding.PKCS7(algorithms.AES.block_size).padder()
+    padded_data = padder.update(data.encode()) + padder.finalize()
+
+    encrypted_data = encryptor.update(padded_data) + encryptor.finalize()
+    return base64.b64encode(encrypted_data).decode('utf-8')
+
+# Return the plaintext, or None if the value does not decrypt under the key
+def try_decrypt(value, key):
+    try:
+        return decrypt_data(value, key)
+    except ValueError:  # bad padding or not UTF-8 (UnicodeDecodeError is a ValueError)
+        return None
+
+# Re-encrypt a value from the old key to the new key without it leaving memory.
+# Rows written by the app after a rotation hold new-key values with no marker,
+# so values that already decrypt under the new key are kept as they are.
+def rotate_value(value):
+    old_plaintext = try_decrypt(value, old_key)
+    new_plaintext = try_decrypt(value, new_key)
+    if new_plaintext is not None and old_plaintext is None:
+        return value
+    if old_plaintext is not None and new_plaintext is None:
+        return encrypt_data(old_plaintext, new_key)
+    if old_plaintext is None:
+        raise ValueError("value decrypts under neither the old nor the new key")
+    raise ValueError("value decrypts under both keys; cannot tell which one it uses")
+
+# Create a database connection using SQLAlchemy
+db_url = f'mysql+pymysql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
+engine = create_engine(db_url)
+Session = sessionmaker(bind=engine)
+
+# Metadata object to hold table information
+metadata = MetaData()
+
+# Add the key version column to a table if it does not exist yet
+def ensure_key_version_column(table_name):
+    # The column name comes from the environment and ends up in DDL
+    if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]{0,63}', key_version_column):
+        raise ValueError(f"Invalid KEY_VERSION_COLUMN: {key_version_column!r}")
+
+    table = Table(table_name, MetaData(), autoload_with=engine)
+    if key_version_column not in table.c:
+        print(f"Adding column {key_version_column} to {table_name}...")
+        preparer = engine.dialect.identifier_preparer
+        with engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE {preparer.quote(table_name)} ADD COLUMN {preparer.quote(key_version_column)} VARCHAR(64) NULL"))
+
+# Function to re-encrypt the given columns of a table, committing every chunk_size rows
+def rotate_table_columns(table, columns):
+    version = table.c[key_version_column]
+    last_id = None
+    rotated_rows = 0
+
+    # Update by primary key; the SET clause is taken from the parameter keys
+    update_stmt = table.update().where(table.c.id == bindparam('row_id'))
+
+    while True:
+        with engine.begin() as connection:  # Each chunk is committed on its own
+            session = Session(bind=connection)
+
+            # Fetch the next chunk of rows not yet on the new key
+            select_stmt = (
+                table.select()
+                .where(or_(version.is_(None), version != key_version))
+                .order_by(table.c.id)
+                .limit(chunk_size)
+            )
+            if last_id is not None:
+                select_stmt = select_stmt.where(table.c.id > last_id)
+            results = session.execute(select_stmt).fetchall()
+            if not results:
+                break
+
+            update_data = []
+            for row in results:
+                row_data = {'row_id': row._mapping['id'], key_version_column: key_version}
+                for column in columns:
+                    value = row._mapping[column]
+                    try:
+                        row_data[column] = rotate_value(value) if value else value
+                    except (ValueError, TypeError) as e:
+                        raise ValueError(f"Cannot rotate {table.name}.{column} for row ID {row._mapping['id']}: {e}") from e
+                update_data.append(row_data)
+
+            connection.execute(update_stmt, update_data)
+            last_id = results[-1]._mapping['id']
+
+        rotated_rows += len(results)
+        print(f"Rotated {rotated_rows} rows in {table.name} (last ID {last_id})")
+
+    return rotated_rows
+
+# Run the key rotation for both tables
+def main():
+    print(f"Starting key rotation to key version {key_version}...")
+
+    ensure_key_version_column('finance_reco')
+    ensure_key_version_column('finance_deals')
+
+    # Define the tables
+    finance_reco = Table('finance_reco', metadata, autoload_with=engine)
+    finance_deals = Table('finance_deals', metadata, autoload_with=engine)
+
+    print("Starting key rotation for finance_reco table...")
+    rotate_table_columns(finance_reco, ['customer_name', 'salesperson_name', 'submission_name'])
+
+    print("Starting key rotation for finance_deals table...")
+    rotate_table_columns(finance_deals, ['customer_name'])
+
+    print("Key rotation completed. Set ENCRYPTION_KEY to the new key before running encyption.py or decyption.py again.")
+    print(f"Writers using the new key should set {key_version_column} = '{key_version}' on the rows they write; "
+          "unmarked rows are checked against both keys on the next run.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import os
+import subprocess
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import re
+import codecs
+from xml.sax.saxutils import unescape
+import boto3
+from dotenv import load_dotenv
+import backup_archive
+from TaskSchedulerBackup import TASK_ARCHIVE_NAME, task_backup_key
+
+# Restore crontab and Task Scheduler backups written by crontab_backup.py and
+# TaskSchedulerBackup.py. Both the per-object layout and the archive layout
+# (ARCHIVE_MODE=yes) are understood, so a restore works across a switch.
+#
+#   python restore_backup.py crontab .env --name alice --date 20240131 --apply
+#   python restore_backup.py tasks .env --dry-run
+
+# Initialize a list to hold error messages
+error_messages = []
+
+def get_s3_client():
+    return boto3.client(
+        's3',
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_KEY'),
+        region_name=os.getenv('AWS_REGION')
+    )
+
+def key_date(key):
+    """Return the backup date encoded in a key, or None if it has none."""
+    date_str = key.split('_')[-1].split('.')[0]
+    try:
+        return datetime.strptime(date_str, '%Y%m%d')
+    except ValueError:
+        return None
+
+def list_dated_keys(s3_client, s3_bucket_name, prefix, suffix, as_of, exact=True):
+    """List keys under a prefix with the given suffix dated on or before as_of, newest first.
+
+    With exact=True only keys made of the prefix and a date are kept, so the
+    prefix "Backup_" does not also match "Backup_Nightly_20240101.xml".
+    """
+    dated_keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=s3_bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if not key.endswith(suffix):
+                continue
+            if exact and '_' in key[len(prefix):]:
+                continue
+            backup_date = key_date(key)
+            if backup_date is not None and backup_date <= as_of:
+                dated_keys.append((backup_date, key))
+    dated_keys.sort(reverse=True)
+    return dated_keys
+
+class ArchiveIndexes:
+    """Lazily loaded archive indexes, newest first, shared by all lookups of a restore."""
+
+    def __init__(self, s3_client, s3_bucket_name, archive_keys):
+        self.s3_client = s3_client
+        self.s3_bucket_name = s3_bucket_name
+        self.archive_keys = archive_keys
+        self.indexes = {}
+
+    def get(self, archive_key):
+        if archive_key not in self.indexes:
+            self.indexes[archive_key] = backup_archive.load_index(self.s3_client, self.s3_bucket_name, archive_key)
+        return self.indexes[archive_key]
+
+    def find(self, entry_name, newer_than=None):
+        """Return (date, index) of the newest archive holding entry_name, or None."""
+        for backup_date, archive_key in self.archive_keys:
+            if newer_than is not None and backup_date <= newer_than:
+                break
+            index = self.get(archive_key)
+            if index is not None and entry_name in index['entries']:
+                return backup_date, index
+        return None
+
+def resolve_backup(name, entry_name, object_keys, archives):
+    """Pick the newest backup of an entry from per-object keys and archives."""
+    backup = None
+    if object_keys:
+        backup_date, key = object_keys[0]
+        backup = {'name': name, 'entry': entry_name, 'date': backup_date, 'key': key, 'index': None}
+
+    found = archives.find(entry_name, newer_than=backup['date'] if backup else None)
+    if found:
+        backup_date, index = found
+        backup = {'name': name, 'entry': entry_name, 'date': backup_date, 'key': index['archive'], 'index': index}
+    return backup
+
+def download_backup(s3_client, s3_bucket_name, backup):
+    if backup['index'] is not None:
+        return backup_archive.read_entry(s3_client, s3_bucket_name, backup['index'], backup['entry'])
+    return s3_client.get_object(Bucket=s3_bucket_name, Key=backup['key'])['Body'].read()
+
+# Resolve the latest crontab backup of each user as of a date
+def resolve_crontab_backups(s3_client, s3_bucket_name, users, as_of):
+    s3_path = os.getenv('S3_PATH', '').strip()
+    crontab_backup_filename = os.getenv('CRONTAB_BACKUP_FILENAME')
+
+    archive_prefix = f"{crontab_backup_filename}_"
+    if s3_path:
+        archive_prefix = os.path.join(s3_path, archive_prefix)
+    archive_keys = list_dated_keys(s3_client, s3_bucket_name, archive_prefix, backup_archive.ARCHIVE_SUFFIX, as_of)
+    archives = ArchiveIndexes(s3_client, s3_bucket_name, archive_keys)
+
+    backups = []
+    for user in users:
+        user_prefix = f"{user}_{crontab_backup_filename}_"
+        if s3_path:
+            user_prefix = os.path.join(s3_path, user_prefix)
+        object_keys = list_dated_keys(s3_client, s3_bucket_name, user_prefix, '.txt', as_of)
+        backup = resolve_backup(user, f"{user}.txt", object_keys, archives)
+        if backup:
+            backups.append(backup)
+        else:
+            error_message = f"No crontab backup found for user {user} on or before {as_of:%Y%m%d}"
+            print(error_message)
+            error_messages.append(error_message)
+    return backups
+
+# Resolve the latest task backups as of a date, either for named tasks or the whole backup folder
+def resolve_task_backups(s3_client, s3_bucket_name, task_names, as_of):
+    s3_backup_folder = os.getenv('S3_BACKUP_FOLDER')
+    upload_to_taskscheduler = os.getenv('UPLOAD_TO_TASKSCHEDULER', 'yes')
+
+    archive_prefix = task_backup_key(f"{TASK_ARCHIVE_NAME}_", upload_to_taskscheduler, s3_backup_folder)
+    archive_keys = list_dated_keys(s3_client, s3_bucket_name, archive_prefix, backup_archive.ARCHIVE_SUFFIX, as_of)
+    archives = ArchiveIndexes(s3_client, s3_bucket_name, archive_keys)
+
+    backups = []
+    if task_names:
+        for task_name in task_names:
+            object_keys = list_dated_keys(s3_client, s3_bucket_name, task_backup_key(f"{task_name}_", upload_to_taskscheduler, s3_backup_folder), '.xml', as_of)
+            backup = resolve_backup(task_name, f"{task_name}.xml", object_keys, archives)
+            if backup:
+                backups.append(backup)
+            else:
+                error_message = f"No backup found for task {task_name} on or before {as_of:%Y%m%d}"
+                print(error_message)
+                error_messages.append(error_message)
+        return backups
+
+    # Whole folder: restore the tasks of the most recent backup run on or before the date
+    folder_prefix = task_backup_key('', upload_to_taskscheduler, s3_backup_folder)
+    object_keys = list_dated_keys(s3_client, s3_bucket_name, folder_prefix, '.xml', as_of, exact=False)
+    object_date = object_keys[0][0] if object_keys else None
+    archive_date = archive_keys[0][0] if archive_keys else None
+
+    if archive_date is not None and (object_date is None or archive_date >= object_date):
+        index = archives.get(archive_keys[0][1])
+        if index is not None:
+            for entry_name in index['entries']:
+                backups.append({'name': entry_name[:-len('.xml')], 'entry': entry_name, 'date': archive_date, 'key': index['archive'], 'index': index})
+            return backups
+
+    for backup_date, key in object_keys:
+        if backup_date != object_date:
+            break
+        task_name = key[len(folder_prefix):].rsplit('_', 1)[0]
+        if '/' in task_name:
+            continue
+        backups.append({'name': task_name, 'entry': f"{task_name}.xml", 'date': backup_date, 'key': key, 'index': None})
+
+    if not backups:
+        error_message = f"No task backups found in {folder_prefix or s3_bucket_name} on or before {as_of:%Y%m%d}"
+        print(error_message)
+        error_messages.append(error_message)
+    return backups
+
+# Install a crontab for a user from its backup content
+def apply_crontab(user, content):
+    subprocess.run(['sudo', '-u', user, 'crontab', '-'], input=content, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    print(f"Crontab restored for user {user}")
+
+def decode_task_xml(content):
+    """Decode an exported task XML without trusting its encoding declaration.
+
+    Exports redirected through cmd are usually 8-bit even though the header
+    declares UTF-16, so the bytes themselves decide the encoding.
+    """
+    if content.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return content.decode('utf-16')
+    if content.startswith(b'\xef\xbb\xbf'):
+        return content[3:].decode('utf-8')
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return content.decode('cp1252', errors='replace')
+
+def normalize_task_xml(content):
+    """Re-encode an exported task XML as UTF-16 with a BOM and a matching declaration."""
+    decoded = decode_task_xml(content)
+    decoded = re.sub(r'^(\s*<\?xml[^>]*?encoding=)(["\'])[^"\']*\2', r'\1\2UTF-16\2', decoded, count=1)
+    return codecs.BOM_UTF16_LE + decoded.encode('utf-16-le')
+
+def task_uri(content):
+    """Return the full task path recorded in RegistrationInfo/URI, or None."""
+    match = re.search(r'<URI>\s*([^<]+?)\s*</URI>', decode_task_xml(content))
+    return unescape(match.group(1)) if match else None
+
+# Register a task from its exported XML file
+def apply_task(task_name, xml_path, content, schtasks):
+    # The export keeps the full task path (folder included) in RegistrationInfo/URI
+    task_path = task_uri(content)
+    if task_path is None:
+        error_message = f"Not registering task {task_name}: no <URI> found in its backup, so its folder is unknown ({xml_path})"
+        print(error_message)
+        error_messages.append(error_message)
+        return
+    subprocess.run([schtasks, '/Create', '/TN', task_path, '/XML', xml_path, '/F'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    print(f"Task {task_path} restored")
+
+def restore_backup(s3_client, s3_bucket_name, backup, kind, output_dir, apply, schtasks):
+    content = download_backup(s3_client, s3_bucket_name, backup)
+    if kind == 'tasks':
+        # schtasks parses the file by its declaration, so the bytes have to match it
+        content = normalize_task_xml(content)
+    xml_path = None
+    if output_dir:
+        xml_path = os.path.join(output_dir, backup['entry'])
+        with open(xml_path, 'wb') as restored:
+            restored.write(content)
+        print(f"Restored {backup['name']} ({backup['date']:%Y%m%d}) to {xml_path}")
+
+    if apply:
+        if kind == 'crontab':
+            apply_crontab(backup['name'], content)
+        else:
+            apply_task(backup['name'], xml_path, content, schtasks)
+
+# Main function
+def main(kind, env_file_path, names=None, as_of=None, output_dir=None, apply=False, dry_run=False, workers=8):
+    load_dotenv(env_file_path)
+
+    s3_bucket_name = os.getenv('S3_BUCKET_NAME')
+    as_of = datetime.strptime(as_of, '%Y%m%d') if as_of else datetime.now()
+    s3_client = get_s3_client()
+
+    if kind == 'crontab':
+        users = names or [user.strip() for user in os.getenv('USERS', '').split(',') if user.strip()]
+        backups = resolve_crontab_backups(s3_client, s3_bucket_name, users, as_of)
+    else:
+        backups = resolve_task_backups(s3_client, s3_bucket_name, names, as_of)
+
+    if dry_run:
+        for backup in backups:
+            location = f"{backup['key']}#{backup['entry']}" if backup['index'] else backup['key']
+            print(f"Would restore {backup['name']} ({backup['date']:%Y%m%d}) from s3://{s3_bucket_name}/{location}")
+        return not error_messages
+
+    # schtasks /Create only accepts XML from a file, so task restores always write one out
+    if kind == 'tasks' and apply and not output_dir:
+        output_dir = os.getenv('BACKUP_PATH') or '.'
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    schtasks = os.getenv('PATH_OF_SCHTASKS', 'schtasks')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(restore_backup, s3_client, s3_bucket_name, backup, kind, output_dir, apply, schtasks): backup
+            for backup in backups
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                error_message = f"Error restoring {futures[future]['name']}: {e}"
+                print(error_message)
+                error_messages.append(error_message)
+
+    return not error_messages
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Restore crontab or Task Scheduler backups from S3.")
+    parser.add_argument("kind", choices=['crontab', 'tasks'])
+    parser.add_argument("env_file_path", nargs='?', default=".env")
+    parser.add_argument("--name", action='append', dest='names', help="User (crontab) or task name to restore; repeatable. Defaults to USERS or the whole backup folder")
+    parser.add_argument("--date", help="Restore the latest backup on or before this date (YYYYMMDD). Defaults to today")
+    parser.add_argument("--output-dir", help="Directory to write restored files to")
+    parser.add_argument("--apply", action='store_true', help="Install the restored crontabs / tasks with crontab or schtasks")
+    parser.add_argument("--dry-run", action='store_true', help="Only show what would be restored")
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent downloads")
+    args = parser.parse_args()
+    if not (args.output_dir or args.apply or args.dry_run):
+        parser.error("one of --output-dir, --apply or --dry-run is required")
+    if not main(args.kind, args.env_file_path, args.names, args.date, args.output_dir, args.apply, args.dry_run, args.workers):
+        raise SystemExit(1)